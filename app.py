@@ -1,19 +1,34 @@
 import streamlit as st
-import os
+import re
 import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from audio_recorder_streamlit import audio_recorder
 import dotenv
 
 # Import our custom modules
 from whisper_asr import WhisperASR
-from gemini_llm import GeminiLLM
+from gemini_llm import GeminiLLM, ERROR_RESPONSE
 from gemini_tts import GeminiTTS
 
 # Load environment variables
 dotenv.load_dotenv()
 
+# Sentence boundaries at which the streamed answer is flushed to TTS. Only punctuation
+# followed by whitespace counts (a chunk may end mid "1.000"), and a period right after a
+# digit is skipped so thousands separators and "Langkah 1." markers stay with their sentence
+SENTENCE_BOUNDARY = re.compile(r"(?:(?<!\d)\.|[!?…])\s+")
+
+# Fragments without any letters or digits (e.g. a lone "😊") have nothing to speak
+SPEAKABLE = re.compile(r"\w")
+
+# Number of answered questions kept (with their voice clips) for repeated questions,
+# bounded by memory since clips are held as raw PCM
+MAX_CACHED_ANSWERS = 64
+
 # Page configuration
 st.set_page_config(
     page_title="AI Tutor for Elementary School (Indonesian)",
@@ -87,27 +102,113 @@ if 'current_question' not in st.session_state:
     st.session_state.current_question = ""
 if 'current_answer' not in st.session_state:
     st.session_state.current_answer = ""
-if 'audio_file_path' not in st.session_state:
-    st.session_state.audio_file_path = None
+if 'audio_clips' not in st.session_state:
+    st.session_state.audio_clips = []
 if 'processing' not in st.session_state:
     st.session_state.processing = False
-if 'first_recording' not in st.session_state:
-    st.session_state.first_recording = True
 
 @st.cache_resource
 def load_models():
-    """Load all AI models with caching"""
+    """Load all AI models with caching, the only place WhisperASR is constructed"""
     try:
         whisper_asr = WhisperASR()
         gemini_llm = GeminiLLM()
-        gemini_tts = GeminiTTS()
+        # Share one client (and its connection pool) between the LLM and TTS
+        gemini_tts = GeminiTTS(client=gemini_llm.client)
+        
+        # Warm up the TTS connection in the background so the first answer isn't slower
+        threading.Thread(target=gemini_tts.text_to_pcm, args=("Halo",), daemon=True).start()
+        
         return whisper_asr, gemini_llm, gemini_tts
     except Exception as e:
         st.error(f"Error loading models: {e}")
         return None, None, None
 
+@st.cache_resource
+def get_answer_cache():
+    """Answers and voice clips of previously asked questions, shared across sessions, with its lock"""
+    return OrderedDict(), threading.Lock()
+
+def normalize_question(question):
+    """Normalize a transcribed question so trivially different transcripts share a cache entry"""
+    return " ".join(question.lower().split()).strip(" .?!")
+
+def play_audio_clip(container, audio_clip):
+    """Play a (pcm_bytes, sample_rate) clip of 16-bit mono PCM, or a (wav_bytes, None) fallback clip"""
+    audio_data, sample_rate = audio_clip
+    if sample_rate is not None:
+        # Add the 44-byte header ourselves: an ndarray would make Streamlit re-encode
+        # and peak-normalize each clip, so volume would jump between sentences
+        audio_data = st.session_state.gemini_tts.pcm_to_wav(audio_data, sample_rate)
+    container.audio(audio_data, format="audio/wav")
+
+def play_ready_audio(tts_futures, audio_container, wait=False):
+    """Play synthesized sentences in order as soon as each one is ready"""
+    while len(st.session_state.audio_clips) < len(tts_futures):
+        future = tts_futures[len(st.session_state.audio_clips)]
+        if not wait and not future.done():
+            return
+        
+        audio_clip = future.result()
+        st.session_state.audio_clips.append(audio_clip)
+        if audio_clip:
+            play_audio_clip(audio_container, audio_clip)
+
+def stream_answer(question, answer_placeholder, audio_container, progress_col):
+    """
+    Stream the answer and synthesize each finished sentence while the LLM keeps generating the rest
+    
+    Returns True if the LLM stream completed, False if it failed partway
+    """
+    gemini_tts = st.session_state.gemini_tts
+    tts_futures = []
+    buffer = ""
+    completed = True
+    
+    def submit_tts(text):
+        if not tts_futures:
+            with progress_col:
+                st.info("🔊 Membuat suara jawaban...")
+        tts_futures.append(executor.submit(gemini_tts.text_to_pcm, text))
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        try:
+            for chunk in st.session_state.gemini_llm.generate_response_stream(question, raise_errors=True):
+                st.session_state.current_answer += chunk
+                answer_placeholder.markdown(
+                    f'<div class="answer-display">{st.session_state.current_answer}</div>',
+                    unsafe_allow_html=True
+                )
+                
+                buffer += chunk
+                boundaries = list(SENTENCE_BOUNDARY.finditer(buffer))
+                # Unspeakable fragments stay in the buffer and are sent with the next sentence
+                if boundaries and SPEAKABLE.search(buffer[:boundaries[-1].end()]):
+                    cut = boundaries[-1].end()
+                    submit_tts(buffer[:cut])
+                    buffer = buffer[cut:]
+                
+                play_ready_audio(tts_futures, audio_container)
+        except Exception:
+            # Show and speak the apology after whatever was already generated
+            completed = False
+            error_text = f" {ERROR_RESPONSE}" if st.session_state.current_answer else ERROR_RESPONSE
+            st.session_state.current_answer += error_text
+            answer_placeholder.markdown(
+                f'<div class="answer-display">{st.session_state.current_answer}</div>',
+                unsafe_allow_html=True
+            )
+            buffer += error_text
+        
+        # A trailing emoji-only remainder is dropped rather than spent on a TTS call
+        if SPEAKABLE.search(buffer):
+            submit_tts(buffer)
+        play_ready_audio(tts_futures, audio_container, wait=True)
+    
+    return completed
+
 def process_audio_question(audio_bytes):
-    """Process recorded audio through the complete pipeline"""
+    """Process recorded audio through the streaming STT -> LLM -> TTS pipeline"""
     if audio_bytes is None:
         return
     
@@ -121,30 +222,55 @@ def process_audio_question(audio_bytes):
     
     # Step 1: Speech to Text
     try:
-        if st.session_state.whisper_asr is None:
-            st.session_state.whisper_asr, st.session_state.gemini_llm, st.session_state.gemini_tts = load_models()
-        
         transcribed_text = st.session_state.whisper_asr.transcribe_audio_bytes(audio_bytes)
         
         if transcribed_text:
             st.session_state.current_question = transcribed_text
+            st.session_state.current_answer = ""
+            st.session_state.audio_clips = []
+            
+            st.markdown("**You asked (Text):**")
+            st.markdown(f'<div class="question-display">{transcribed_text}</div>', unsafe_allow_html=True)
             
             with progress_col2:
                 st.info("🤖 Menghasilkan jawaban...")
             
-            # Step 2: Generate Answer
-            answer = st.session_state.gemini_llm.generate_tutor_response(transcribed_text)
+            st.markdown("**Tutor's Answer (Text):**")
+            answer_placeholder = st.empty()
+            st.markdown("**Tutor's Answer (Voice):**")
+            audio_container = st.container()
+            
+            answer_cache, answer_cache_lock = get_answer_cache()
+            cache_key = normalize_question(transcribed_text)
+            with answer_cache_lock:
+                cached = answer_cache.get(cache_key)
+                if cached:
+                    answer_cache.move_to_end(cache_key)
             
-            if answer:
-                st.session_state.current_answer = answer
-                
-                with progress_col3:
-                    st.info("🔊 Membuat suara jawaban...")
-                
-                # Step 3: Text to Speech
-                audio_file_path = st.session_state.gemini_tts.text_to_speech(answer)
-                st.session_state.audio_file_path = audio_file_path
+            if cached:
+                # Repeated question: reuse the answer and its voice without calling Gemini
+                completed = True
+                st.session_state.current_answer, audio_clips = cached
+                st.session_state.audio_clips = list(audio_clips)
+                answer_placeholder.markdown(
+                    f'<div class="answer-display">{st.session_state.current_answer}</div>',
+                    unsafe_allow_html=True
+                )
+                for audio_clip in audio_clips:
+                    play_audio_clip(audio_container, audio_clip)
+            else:
+                completed = stream_answer(transcribed_text, answer_placeholder, audio_container, progress_col3)
                 
+                answer = st.session_state.current_answer
+                audio_clips = st.session_state.audio_clips
+                if completed and answer and audio_clips and all(audio_clips):
+                    with answer_cache_lock:
+                        answer_cache[cache_key] = (answer, list(audio_clips))
+                        if len(answer_cache) > MAX_CACHED_ANSWERS:
+                            answer_cache.popitem(last=False)
+            
+            # A failed stream still leaves the apology in current_answer
+            if completed and st.session_state.current_answer:
                 st.success("✅ Selesai! Jawaban sudah siap.")
             else:
                 st.error("Maaf, terjadi kesalahan dalam menghasilkan jawaban.")
@@ -164,10 +290,6 @@ def main():
     if st.session_state.whisper_asr is None:
         with st.spinner("Loading AI models... This may take a moment on first run."):
             st.session_state.whisper_asr, st.session_state.gemini_llm, st.session_state.gemini_tts = load_models()
-        # Explicitly load the Whisper model
-        if st.session_state.whisper_asr:
-            with st.spinner("Initializing Whisper ASR model..."):
-                st.session_state.whisper_asr.load_model()
     
     # Header
     st.markdown('<h1 class="main-header">🎓 AI Tutor for Elementary School (Indonesian) - Using Whisper ASR</h1>', unsafe_allow_html=True)
@@ -202,21 +324,15 @@ def main():
             neutral_color="#6aa36f",
             icon_name="microphone-lines",
             icon_size="6x",
+            sample_rate=16000,  # Whisper's rate, lets transcription skip decoding and resampling
         )
     
     # Process audio when recording is complete
+    new_question_audio = None
     if audio_bytes:
-        # Skip the first recording (usually empty)
-        if st.session_state.first_recording:
-            st.session_state.first_recording = False
-            st.info("🎤 Ready to record! Click the microphone again to start your question.")
-        else:
-            # Display audio player
-            st.audio(audio_bytes, format="audio/wav")
-            
-            # Process the audio
-            if not st.session_state.processing:
-                process_audio_question(audio_bytes)
+        # Display audio player
+        st.audio(audio_bytes, format="audio/wav")
+        new_question_audio = audio_bytes
     
     # Section 2: Interaction Results
     st.markdown('<h2 class="section-header">2. Interaction</h2>', unsafe_allow_html=True)
@@ -226,8 +342,12 @@ def main():
         st.markdown('<div class="processing-spinner">Processing your question...</div>', unsafe_allow_html=True)
         st.spinner("Please wait...")
     
+    # Process the audio, rendering the answer as it streams in
+    if new_question_audio and not st.session_state.processing:
+        process_audio_question(new_question_audio)
+    
     # Display results if available
-    if st.session_state.current_question and not st.session_state.processing:
+    elif st.session_state.current_question and not st.session_state.processing:
         # Display transcribed question
         st.markdown("**You asked (Text):**")
         st.markdown(f'<div class="question-display">{st.session_state.current_question}</div>', unsafe_allow_html=True)
@@ -239,8 +359,10 @@ def main():
             
             # Display audio answer
             st.markdown("**Tutor's Answer (Voice):**")
-            if st.session_state.audio_file_path and os.path.exists(st.session_state.audio_file_path):
-                st.audio(st.session_state.audio_file_path)
+            audio_clips = [clip for clip in st.session_state.audio_clips if clip]
+            if audio_clips:
+                for audio_clip in audio_clips:
+                    play_audio_clip(st, audio_clip)
             else:
                 st.info("Audio is being generated, please wait...")
     
@@ -266,7 +388,7 @@ def main():
         if st.button("🔄 Clear Conversation"):
             st.session_state.current_question = ""
             st.session_state.current_answer = ""
-            st.session_state.audio_file_path = None
+            st.session_state.audio_clips = []
             st.rerun()
 
 if __name__ == "__main__":
@@ -1,27 +1,131 @@
 import os
+import threading
+import time
 from google import genai
 from google.genai import types
 from typing import Optional, Generator
-import dotenv
 
-# Load environment variables
-dotenv.load_dotenv()
+# Yielded by generate_response_stream when the request fails
+ERROR_RESPONSE = "Maaf, terjadi kesalahan dalam memproses pertanyaan kamu. Coba lagi ya! 😊"
 
 class GeminiLLM:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, client: Optional[genai.Client] = None):
         """
         Initialize Gemini LLM client
         
         Args:
             api_key: Gemini API key (if not provided, loads from GEMINI_API_KEY env var)
+            client: Existing Gemini client to share (if provided, api_key is ignored)
         """
-        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables or provided")
+        if client is None:
+            self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+            if not self.api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment variables or provided")
+            client = genai.Client(api_key=self.api_key)
         
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = client
         self.model = "gemini-2.5-flash-lite"
         
+        # System prompt for Indonesian elementary school tutor
+        self._system_prompt_text = """Kamu adalah tutor AI untuk siswa sekolah dasar Indonesia. 
+        Jawab pertanyaan dengan:
+        - Bahasa Indonesia yang mudah dipahami anak SD
+        - Penjelasan yang sederhana dan jelas
+        - Gunakan contoh-contoh yang familiar untuk anak Indonesia
+        - Bersikap ramah, sabar, dan mendorong
+        - Berikan penjelasan step-by-step jika diperlukan
+        - Gunakan emoji yang sesuai untuk membuat jawaban lebih menarik
+        """
+        self._tools = [
+            types.Tool(googleSearch=types.GoogleSearch()),
+        ]
+        self._cache_ttl_seconds = 3600
+        self._cache_name = None
+        self._cache_expires_at = 0.0
+        self._cache_lock = threading.Lock()
+        self._generate_content_config = None
+        
+        # Create the prompt cache up front so the first question doesn't pay for it
+        self._refresh_generate_content_config()
+    
+    def _create_prompt_cache(self) -> Optional[str]:
+        """
+        Cache the system prompt and tools server-side so they are not re-sent with every question
+        
+        Returns:
+            Name of the cached content or None if caching is unavailable (e.g. prompt below the minimum size)
+        """
+        try:
+            cache = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self._system_prompt_text,
+                    tools=self._tools,
+                    ttl=f"{self._cache_ttl_seconds}s",
+                ),
+            )
+            return cache.name
+        except Exception as e:
+            print(f"Context caching unavailable, sending system prompt inline: {e}")
+            return None
+    
+    def _refresh_generate_content_config(self):
+        """Create the prompt cache and build the generation config around it"""
+        self._cache_name = self._create_prompt_cache()
+        if self._cache_name:
+            # Refresh a minute early so in-flight requests never see an expired cache. The
+            # previous cache isn't deleted: requests holding the old config may still use it,
+            # and it expires on its own within that minute
+            self._cache_expires_at = time.time() + self._cache_ttl_seconds - 60
+            prompt_config = {"cached_content": self._cache_name}
+        else:
+            # Don't retry a failed cache creation, send the prompt inline instead
+            self._cache_expires_at = float("inf")
+            prompt_config = {"system_instruction": self._system_prompt_text, "tools": self._tools}
+        
+        self._generate_content_config = types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(
+                thinking_budget=0,
+            ),
+            temperature=0.7,  # Slightly creative but consistent
+            max_output_tokens=1000,  # Reasonable length for elementary students
+            **prompt_config,
+        )
+    
+    def _get_generate_content_config(self) -> types.GenerateContentConfig:
+        """
+        Return the shared generation config, refreshing the prompt cache shortly before it expires
+        
+        Returns:
+            Generation config shared by all requests
+        """
+        if time.time() >= self._cache_expires_at:
+            # Sessions share this instance, so only one of them replaces the cache
+            with self._cache_lock:
+                if time.time() >= self._cache_expires_at:
+                    self._refresh_generate_content_config()
+        
+        return self._generate_content_config
+    
+    def _build_contents(self, student_question: str) -> list:
+        """
+        Wrap the student's question as the only user turn
+        
+        Args:
+            student_question: Student's question in Indonesian
+            
+        Returns:
+            Contents for the generate request
+        """
+        return [
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part.from_text(text=student_question),
+                ],
+            ),
+        ]
+        
     def generate_tutor_response(self, student_question: str) -> Optional[str]:
         """
         Generate educational response for Indonesian elementary school students
@@ -33,101 +137,37 @@ class GeminiLLM:
             Tutor's response in Indonesian or None if error
         """
         try:
-            # Create system prompt for Indonesian elementary school tutor
-            system_prompt = """Kamu adalah tutor AI untuk siswa sekolah dasar Indonesia. 
-            Jawab pertanyaan dengan:
-            - Bahasa Indonesia yang mudah dipahami anak SD
-            - Penjelasan yang sederhana dan jelas
-            - Gunakan contoh-contoh yang familiar untuk anak Indonesia
-            - Bersikap ramah, sabar, dan mendorong
-            - Berikan penjelasan step-by-step jika diperlukan
-            - Gunakan emoji yang sesuai untuk membuat jawaban lebih menarik
-            """
-            
-            full_prompt = f"{system_prompt}\n\nPertanyaan siswa: {student_question}"
-            
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=full_prompt),
-                    ],
-                ),
-            ]
-            
-            tools = [
-                types.Tool(googleSearch=types.GoogleSearch()),
-            ]
-            
-            generate_content_config = types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(
-                    thinking_budget=0,
-                ),
-                tools=tools,
-                temperature=0.7,  # Slightly creative but consistent
-                max_output_tokens=1000,  # Reasonable length for elementary students
-            )
+            contents = self._build_contents(student_question)
+            generate_content_config = self._get_generate_content_config()
             
-            # Generate response
-            response_text = ""
-            for chunk in self.client.models.generate_content_stream(
+            # Generate response in a single round trip, streaming is left to generate_response_stream
+            response = self.client.models.generate_content(
                 model=self.model,
                 contents=contents,
                 config=generate_content_config,
-            ):
-                if chunk.text:
-                    response_text += chunk.text
+            )
             
-            return response_text.strip() if response_text else None
+            return response.text.strip() if response.text else None
             
         except Exception as e:
             print(f"Error generating tutor response: {e}")
             return None
     
-    def generate_response_stream(self, student_question: str) -> Generator[str, None, None]:
+    def generate_response_stream(self, student_question: str, raise_errors: bool = False) -> Generator[str, None, None]:
         """
         Generate streaming educational response for real-time display
         
         Args:
             student_question: Student's question in Indonesian
+            raise_errors: Re-raise failures instead of yielding ERROR_RESPONSE, so callers
+                can tell a stream that broke partway from a complete answer
             
         Yields:
             Response chunks as they are generated
         """
         try:
-            system_prompt = """Kamu adalah tutor AI untuk siswa sekolah dasar Indonesia. 
-            Jawab pertanyaan dengan:
-            - Bahasa Indonesia yang mudah dipahami anak SD
-            - Penjelasan yang sederhana dan jelas
-            - Gunakan contoh-contoh yang familiar untuk anak Indonesia
-            - Bersikap ramah, sabar, dan mendorong
-            - Berikan penjelasan step-by-step jika diperlukan
-            - Gunakan emoji yang sesuai untuk membuat jawaban lebih menarik
-            """
-            
-            full_prompt = f"{system_prompt}\n\nPertanyaan siswa: {student_question}"
-            
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=full_prompt),
-                    ],
-                ),
-            ]
-            
-            tools = [
-                types.Tool(googleSearch=types.GoogleSearch()),
-            ]
-            
-            generate_content_config = types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(
-                    thinking_budget=0,
-                ),
-                tools=tools,
-                temperature=0.7,
-                max_output_tokens=1000,
-            )
+            contents = self._build_contents(student_question)
+            generate_content_config = self._get_generate_content_config()
             
             for chunk in self.client.models.generate_content_stream(
                 model=self.model,
@@ -139,4 +179,6 @@ class GeminiLLM:
                     
         except Exception as e:
             print(f"Error generating streaming response: {e}")
-            yield f"Maaf, terjadi kesalahan dalam memproses pertanyaan kamu. Coba lagi ya! 😊"
\ No newline at end of file
+            if raise_errors:
+                raise
+            yield ERROR_RESPONSE
\ No newline at end of file
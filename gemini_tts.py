@@ -5,28 +5,86 @@ import re
 import struct
 from google import genai
 from google.genai import types
-from typing import Optional, Tuple
-import dotenv
+from typing import Iterator, Optional, Tuple
 import tempfile
 
-# Load environment variables
-dotenv.load_dotenv()
+# 44-byte PCM WAV header, compiled once
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+# Matches the sample size ("audio/L16") and rate ("rate=24000") of a PCM MIME type in one scan
+_MIME_RE = re.compile(r"audio/L(?P<bits>\d+)|rate=(?P<rate>\d+)", re.I)
 
 class GeminiTTS:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, client: Optional[genai.Client] = None):
         """
         Initialize Gemini TTS client
         
         Args:
             api_key: Gemini API key (if not provided, loads from GEMINI_API_KEY env var)
+            client: Existing Gemini client to share (if provided, api_key is ignored)
         """
-        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables or provided")
+        if client is None:
+            self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+            if not self.api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment variables or provided")
+            client = genai.Client(api_key=self.api_key)
         
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = client
         self.model = "gemini-2.5-flash-preview-tts"
         
+        # One-slot cache of (mime_type, fmt fields) for the last MIME type, stored as a
+        # single tuple so concurrent text_to_speech calls never see a torn update
+        self._last_wav_format = None
+        
+    def _stream_audio(self, text: str) -> Iterator[Tuple[str, bytes]]:
+        """
+        Stream synthesized audio from Gemini TTS
+        
+        Args:
+            text: Text to convert to speech
+            
+        Yields:
+            (mime_type, data) for each audio chunk as it arrives
+        """
+        contents = [
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part.from_text(text=text),
+                ],
+            ),
+        ]
+        
+        generate_content_config = types.GenerateContentConfig(
+            temperature=1,
+            response_modalities=[
+                "audio",
+            ],
+            speech_config=types.SpeechConfig(
+                voice_config=types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                        voice_name="Zephyr"
+                    )
+                )
+            ),
+        )
+        
+        for chunk in self.client.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=generate_content_config,
+        ):
+            if (
+                chunk.candidates is None
+                or chunk.candidates[0].content is None
+                or chunk.candidates[0].content.parts is None
+            ):
+                continue
+                
+            part = chunk.candidates[0].content.parts[0]
+            if part.inline_data and part.inline_data.data:
+                yield part.inline_data.mime_type, part.inline_data.data
+    
     def text_to_speech(self, text: str, output_path: Optional[str] = None) -> Optional[str]:
         """
         Convert text to speech using Gemini TTS
@@ -38,130 +96,155 @@ class GeminiTTS:
         Returns:
             Path to generated audio file or None if error
         """
+        created_temp_file = False
         try:
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=text),
-                    ],
-                ),
-            ]
+            # Write audio chunks to disk as they arrive instead of buffering the whole response
+            output_file = None
+            mime_type = None
+            needs_wav_header = False
+            data_size = 0
+            try:
+                for chunk_mime_type, data in self._stream_audio(text):
+                    if output_file is None:
+                        mime_type = chunk_mime_type
+                        
+                        # Raw PCM needs a WAV container, anything else is saved as-is
+                        needs_wav_header = bool(mime_type) and "wav" not in mime_type.lower()
+                        if needs_wav_header:
+                            file_extension = ".wav"
+                        else:
+                            file_extension = mimetypes.guess_extension(mime_type or "") or ".wav"
+                        
+                        if output_path is None:
+                            temp_file = tempfile.NamedTemporaryFile(
+                                suffix=file_extension, 
+                                delete=False
+                            )
+                            output_path = temp_file.name
+                            temp_file.close()
+                            created_temp_file = True
+                        
+                        output_file = open(output_path, "wb")
+                        if needs_wav_header:
+                            # Placeholder header, patched with the final size after the last chunk
+                            output_file.write(self._wav_header(mime_type, 0))
+                    
+                    output_file.write(data)
+                    data_size += len(data)
+                
+                if output_file is None:
+                    print("No audio data received")
+                    return None
+                
+                if needs_wav_header:
+                    output_file.seek(0)
+                    output_file.write(self._wav_header(mime_type, data_size))
+            finally:
+                if output_file is not None:
+                    output_file.close()
             
-            generate_content_config = types.GenerateContentConfig(
-                temperature=1,
-                response_modalities=[
-                    "audio",
-                ],
-                speech_config=types.SpeechConfig(
-                    voice_config=types.VoiceConfig(
-                        prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                            voice_name="Zephyr"
-                        )
-                    )
-                ),
-            )
+            print(f"Audio saved to: {output_path}")
+            return output_path
             
-            # Generate audio chunks
+        except Exception as e:
+            print(f"Error generating speech: {e}")
+            # Don't leave a half-written temp file behind
+            if created_temp_file and os.path.exists(output_path):
+                os.unlink(output_path)
+            return None
+    
+    def text_to_pcm(self, text: str) -> Optional[Tuple[bytes, Optional[int]]]:
+        """
+        Convert text to speech as raw 16-bit PCM, skipping the WAV container and file I/O
+        
+        Args:
+            text: Text to convert to speech
+            
+        Returns:
+            Tuple of (pcm_bytes, sample_rate) for 16-bit PCM, (wav_bytes, None) for any other
+            format (built the same way as text_to_speech), or None if error
+        """
+        try:
+            mime_type = None
             audio_chunks = []
-            for chunk in self.client.models.generate_content_stream(
-                model=self.model,
-                contents=contents,
-                config=generate_content_config,
-            ):
-                if (
-                    chunk.candidates is None
-                    or chunk.candidates[0].content is None
-                    or chunk.candidates[0].content.parts is None
-                ):
-                    continue
-                    
-                part = chunk.candidates[0].content.parts[0]
-                if part.inline_data and part.inline_data.data:
-                    audio_chunks.append(part.inline_data)
+            for chunk_mime_type, data in self._stream_audio(text):
+                if mime_type is None:
+                    mime_type = chunk_mime_type
+                audio_chunks.append(data)
             
             if not audio_chunks:
                 print("No audio data received")
                 return None
             
-            # Combine all audio chunks
-            combined_audio_data = b""
-            mime_type = None
-            
-            for chunk_data in audio_chunks:
-                combined_audio_data += chunk_data.data
-                if mime_type is None:
-                    mime_type = chunk_data.mime_type
+            audio_data = b"".join(audio_chunks)
+            if mime_type and mime_type.lower().startswith("audio/l16"):
+                return audio_data, self._parse_audio_mime_type(mime_type)["rate"]
             
-            # Convert to WAV if needed
+            # Other formats fall back to a WAV file, like text_to_speech writes
             if mime_type and "wav" not in mime_type.lower():
-                combined_audio_data = self._convert_to_wav(combined_audio_data, mime_type)
-                file_extension = ".wav"
-            else:
-                file_extension = mimetypes.guess_extension(mime_type) or ".wav"
-            
-            # Save to file
-            if output_path is None:
-                temp_file = tempfile.NamedTemporaryFile(
-                    suffix=file_extension, 
-                    delete=False
-                )
-                output_path = temp_file.name
-                temp_file.close()
-            
-            with open(output_path, "wb") as f:
-                f.write(combined_audio_data)
-            
-            print(f"Audio saved to: {output_path}")
-            return output_path
+                audio_data = self._wav_header(mime_type, len(audio_data)) + audio_data
+            return audio_data, None
             
         except Exception as e:
             print(f"Error generating speech: {e}")
             return None
     
-    def _convert_to_wav(self, audio_data: bytes, mime_type: str) -> bytes:
+    def pcm_to_wav(self, pcm_bytes: bytes, sample_rate: int) -> bytes:
         """
-        Converts audio data to WAV format
+        Wrap raw 16-bit mono PCM from text_to_pcm in a WAV container
         
         Args:
-            audio_data: The raw audio data as bytes
-            mime_type: MIME type of the audio data
+            pcm_bytes: Raw 16-bit PCM audio data
+            sample_rate: Sample rate of the audio data
             
         Returns:
             WAV formatted audio data
         """
-        try:
+        return self._wav_header(f"audio/L16;rate={sample_rate}", len(pcm_bytes)) + pcm_bytes
+    
+    def _wav_header(self, mime_type: str, data_size: int) -> bytes:
+        """
+        Builds a WAV header for raw PCM audio data
+        
+        Args:
+            mime_type: MIME type of the audio data
+            data_size: Size of the audio data in bytes
+            
+        Returns:
+            44-byte WAV header
+        """
+        last_wav_format = self._last_wav_format
+        if last_wav_format is not None and last_wav_format[0] == mime_type:
+            wav_format = last_wav_format[1]
+        else:
             parameters = self._parse_audio_mime_type(mime_type)
             bits_per_sample = parameters["bits_per_sample"]
             sample_rate = parameters["rate"]
             num_channels = 1
-            data_size = len(audio_data)
             bytes_per_sample = bits_per_sample // 8
             block_align = num_channels * bytes_per_sample
             byte_rate = sample_rate * block_align
-            chunk_size = 36 + data_size
-            
-            header = struct.pack(
-                "<4sI4s4sIHHIIHH4sI",
-                b"RIFF",          # ChunkID
-                chunk_size,       # ChunkSize (total file size - 8 bytes)
-                b"WAVE",          # Format
-                b"fmt ",          # Subchunk1ID
-                16,               # Subchunk1Size (16 for PCM)
-                1,                # AudioFormat (1 for PCM)
-                num_channels,     # NumChannels
-                sample_rate,      # SampleRate
-                byte_rate,        # ByteRate
-                block_align,      # BlockAlign
-                bits_per_sample,  # BitsPerSample
-                b"data",          # Subchunk2ID
-                data_size         # Subchunk2Size (size of audio data)
-            )
-            return header + audio_data
-            
-        except Exception as e:
-            print(f"Error converting to WAV: {e}")
-            return audio_data
+            wav_format = (num_channels, sample_rate, byte_rate, block_align, bits_per_sample)
+            self._last_wav_format = (mime_type, wav_format)
+        
+        num_channels, sample_rate, byte_rate, block_align, bits_per_sample = wav_format
+        chunk_size = 36 + data_size
+        
+        return _WAV_HEADER.pack(
+            b"RIFF",          # ChunkID
+            chunk_size,       # ChunkSize (total file size - 8 bytes)
+            b"WAVE",          # Format
+            b"fmt ",          # Subchunk1ID
+            16,               # Subchunk1Size (16 for PCM)
+            1,                # AudioFormat (1 for PCM)
+            num_channels,     # NumChannels
+            sample_rate,      # SampleRate
+            byte_rate,        # ByteRate
+            block_align,      # BlockAlign
+            bits_per_sample,  # BitsPerSample
+            b"data",          # Subchunk2ID
+            data_size         # Subchunk2Size (size of audio data)
+        )
     
     def _parse_audio_mime_type(self, mime_type: str) -> dict:
         """
@@ -173,26 +256,17 @@ class GeminiTTS:
         Returns:
             Dictionary with "bits_per_sample" and "rate" keys
         """
-        bits_per_sample = 16
-        rate = 24000
-        
-        # Extract rate from parameters
-        parts = mime_type.split(";")
-        for param in parts:
-            param = param.strip()
-            if param.lower().startswith("rate="):
-                try:
-                    rate_str = param.split("=", 1)[1]
-                    rate = int(rate_str)
-                except (ValueError, IndexError):
-                    pass
-            elif param.startswith("audio/L"):
-                try:
-                    bits_per_sample = int(param.split("L", 1)[1])
-                except (ValueError, IndexError):
-                    pass
-        
-        return {"bits_per_sample": bits_per_sample, "rate": rate}
+        parameters = {
+            key: value
+            for match in _MIME_RE.finditer(mime_type)
+            for key, value in match.groupdict().items()
+            if value
+        }
+        
+        return {
+            "bits_per_sample": int(parameters.get("bits", 16)),
+            "rate": int(parameters.get("rate", 24000)),
+        }
     
     def get_audio_bytes(self, text: str) -> Optional[bytes]:
         """
@@ -1,27 +1,77 @@
+import gc
+import io
 import os
+import struct
+import threading
 import torch
 import warnings
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
 import soundfile as sf
 import numpy as np
-from typing import Optional
-import tempfile
+from typing import List, Optional, Union
+
+# Whisper's encoder sees at most 30 seconds of 16kHz audio per input
+CHUNK_SAMPLES = 30 * 16000
+
+# Upper bound on decoded tokens per chunk, plenty for a spoken question
+MAX_NEW_TOKENS = 128
 
 class WhisperASR:
-    def __init__(self, model_name: str = "conevonce/whisper-small-id3"):
+    def __init__(
+        self,
+        model_name: str = "conevonce/whisper-small-id3",
+        ct2_model_path: Optional[str] = None,
+        onnx_model_path: Optional[str] = None,
+    ):
         """
-        Initialize Whisper ASR with Indonesian fine-tuned model using direct transformers
+        Initialize Whisper ASR with Indonesian fine-tuned model and load its weights
+        
+        Construct this once (the app caches it with st.cache_resource), since every
+        instance holds its own copy of the model.
         
         Args:
             model_name: HuggingFace model name for Indonesian Whisper
+            ct2_model_path: Path to a CTranslate2 conversion of the model for faster-whisper
+                (if not provided, loads from WHISPER_CT2_MODEL env var)
+            onnx_model_path: Path to an onnxruntime beam search export of the model
+                (if not provided, loads from WHISPER_ONNX_MODEL env var)
         """
         self.model_name = model_name
+        self.ct2_model_path = ct2_model_path or os.environ.get("WHISPER_CT2_MODEL")
+        self.onnx_model_path = onnx_model_path or os.environ.get("WHISPER_ONNX_MODEL")
         self.processor = None
         self.model = None
+        self.backend = None
+        self._onnx_inputs = {}
+        self._onnx_prompt_ids = []
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = torch.float32
+        self._eager_forward = None
+        # The instance is shared by all sessions, and generate() reuses one static KV cache
+        # and its CUDA graph buffers (the VAD model is stateful too), so only one may run at a time
+        self._inference_lock = threading.Lock()
+        self.vad_model = None
+        self._get_speech_timestamps = None
+        self.load_model()
         
+    def _from_pretrained(self, model_class, model_name: str):
+        """Load from the local HuggingFace cache, only downloading when the model isn't cached yet"""
+        try:
+            return model_class.from_pretrained(model_name, local_files_only=True)
+        except OSError:
+            return model_class.from_pretrained(model_name)
+    
     def load_model(self):
-        """Load the Whisper model using WhisperProcessor and WhisperForConditionalGeneration"""
+        """Load the Whisper model, preferring faster-whisper or onnxruntime exports when configured"""
+        if self.ct2_model_path and self._load_ct2_model():
+            return
+        
+        # faster-whisper has its own VAD, the other backends trim silence with Silero
+        self._load_vad_model()
+        
+        if self.onnx_model_path and self._load_onnx_model():
+            return
+        
         try:
             print(f"Loading Whisper model: {self.model_name}")
             
@@ -32,79 +82,388 @@ class WhisperASR:
             
             # Try loading the specified model
             try:
-                self.processor = WhisperProcessor.from_pretrained(self.model_name)
-                self.model = WhisperForConditionalGeneration.from_pretrained(self.model_name)
+                self.processor = self._from_pretrained(WhisperProcessor, self.model_name)
+                self.model = self._from_pretrained(WhisperForConditionalGeneration, self.model_name)
                 self.model.config.forced_decoder_ids = None
                 print(f"Successfully loaded {self.model_name}")
             except Exception as e:
                 print(f"Failed to load {self.model_name}: {e}")
                 print("Falling back to base whisper-small model...")
                 
+                # Release any half-loaded weights before loading a second model
+                self.processor = None
+                self.model = None
+                gc.collect()
+                if self.device == "cuda":
+                    torch.cuda.empty_cache()
+                
                 # Fallback to base model
-                self.processor = WhisperProcessor.from_pretrained("openai/whisper-small")
-                self.model = WhisperForConditionalGeneration.from_pretrained("openai/whisper-small")
+                self.processor = self._from_pretrained(WhisperProcessor, "openai/whisper-small")
+                self.model = self._from_pretrained(WhisperForConditionalGeneration, "openai/whisper-small")
                 self.model.config.forced_decoder_ids = None
                 print("Successfully loaded openai/whisper-small as fallback")
             
-            # Move model to device
+            # Move model to device, in half precision on GPU (bfloat16 on Ampere and newer)
             self.model = self.model.to(self.device)
-            print(f"Model ready on {self.device}")
+            if self.device == "cuda":
+                # Only native bf16 counts, emulated bf16 on older GPUs is slower than fp16
+                native_bf16 = torch.cuda.get_device_capability()[0] >= 8
+                self.dtype = torch.bfloat16 if native_bf16 else torch.float16
+                self.model = self.model.to(dtype=self.dtype)
+            self.backend = "transformers"
+            # Compilation, CUDA graphs and cuDNN autotuning are GPU-only, on CPU a warmup just delays startup
+            if self.device == "cuda":
+                self._compile_model()
+                self._warmup()
+            print(f"Model ready on {self.device} ({self.dtype})")
             
         except Exception as e:
             print(f"Error loading model: {e}")
             raise e
     
-    def transcribe_audio(self, audio_file_path: str) -> Optional[str]:
+    def _load_vad_model(self):
+        """Load the Silero VAD model used to drop silence before the encoder"""
+        if self.vad_model is not None:
+            return
+        
+        try:
+            self.vad_model, utils = torch.hub.load("snakers4/silero-vad", "silero_vad")
+            self._get_speech_timestamps = utils[0]
+        except Exception as e:
+            print(f"Warning: Silero VAD not available, transcribing the full recording: {e}")
+            self.vad_model = None
+            self._get_speech_timestamps = None
+    
+    def _speech_chunks(self, audio_input: np.ndarray) -> List[np.ndarray]:
         """
-        Transcribe audio file to text
+        Keep only the speech in a recording, packed into chunks of at most 30 seconds
         
         Args:
-            audio_file_path: Path to audio file
+            audio_input: Mono 16kHz audio samples
+            
+        Returns:
+            Speech-only audio chunks (empty if no speech was detected)
+        """
+        # Silero VAD is stateful (reset on every call, then fed window by window) and shared
+        # by all sessions, so it runs under the same lock as generate()
+        with self._inference_lock:
+            speech_timestamps = self._get_speech_timestamps(
+                torch.from_numpy(np.ascontiguousarray(audio_input, dtype=np.float32)),
+                self.vad_model,
+                sampling_rate=16000
+            )
+        
+        chunks = []
+        current = []
+        current_length = 0
+        for timestamp in speech_timestamps:
+            segment = audio_input[timestamp["start"]:timestamp["end"]]
+            # Segments longer than the encoder window are split on the window size
+            for start in range(0, len(segment), CHUNK_SAMPLES):
+                piece = segment[start:start + CHUNK_SAMPLES]
+                if current_length + len(piece) > CHUNK_SAMPLES:
+                    chunks.append(np.concatenate(current))
+                    current = []
+                    current_length = 0
+                current.append(piece)
+                current_length += len(piece)
+        
+        if current:
+            chunks.append(np.concatenate(current))
+        
+        return chunks
+    
+    def _compile_model(self):
+        """Compile the decoder step with CUDA graphs via torch.compile over a static KV cache"""
+        torch_version = tuple(int(part) for part in torch.__version__.split(".")[:2])
+        if torch_version < (2, 2):
+            print("Warning: torch.compile needs PyTorch 2.2+, running Whisper in eager mode")
+            return
+        
+        # A static cache keeps tensor shapes fixed across decoding steps so graphs can be replayed
+        self._eager_forward = self.model.forward
+        self.model.generation_config.cache_implementation = "static"
+        self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=False)
+    
+    def _warmup(self):
+        """Run a full-window dummy generation on GPU so the first real recording doesn't pay compilation and autotuning"""
+        try:
+            # Go through transcribe_batch so the generate kwargs, and with them the static
+            # cache size and compiled graphs, match real questions exactly
+            dummy_audio = np.zeros(CHUNK_SAMPLES, dtype=np.float32)
+            for _ in range(2):
+                self.transcribe_batch([dummy_audio])
+            
+        except Exception as e:
+            if self._eager_forward is None:
+                print(f"Warning: Whisper warmup failed: {e}")
+                return
+            
+            # Compilation errors only surface on the first call, fall back to eager mode
+            print(f"Warning: compiled Whisper failed, falling back to eager mode: {e}")
+            self.model.forward = self._eager_forward
+            self.model.generation_config.cache_implementation = None
+            self._eager_forward = None
+            self._warmup()
+    
+    def _load_ct2_model(self) -> bool:
+        """
+        Load the CTranslate2 model with faster-whisper using INT8 weights
+        
+        Returns:
+            True if the model was loaded, False to fall back to transformers
+        """
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            print("Warning: faster-whisper not available, falling back to transformers")
+            return False
+        
+        try:
+            print(f"Loading faster-whisper model: {self.ct2_model_path}")
+            compute_type = "int8_float16" if self.device == "cuda" else "int8"
+            self.model = WhisperModel(self.ct2_model_path, device=self.device, compute_type=compute_type)
+            self.processor = None
+            self.backend = "ct2"
+            print(f"Model ready on {self.device} ({compute_type})")
+            return True
+        except Exception as e:
+            print(f"Failed to load {self.ct2_model_path}: {e}")
+            print("Falling back to transformers...")
+            return False
+    
+    def _load_onnx_model(self) -> bool:
+        """
+        Load the fused encoder/decoder beam search graph with onnxruntime
+        
+        Returns:
+            True if the model was loaded, False to fall back to transformers
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print("Warning: onnxruntime not available, falling back to transformers")
+            return False
+        
+        try:
+            print(f"Loading ONNX Whisper model: {self.onnx_model_path}")
+            self.model = ort.InferenceSession(
+                self.onnx_model_path,
+                providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+            )
+            # The processor is only used for log-mel features and decoding
+            self.processor = self._from_pretrained(WhisperProcessor, self.model_name)
+            self._onnx_inputs = {node.name: node.type for node in self.model.get_inputs()}
+            self._onnx_prompt_ids = self.processor.tokenizer.convert_tokens_to_ids(
+                ["<|startoftranscript|>", "<|id|>", "<|transcribe|>", "<|notimestamps|>"]
+            )
+            self.backend = "onnx"
+            print(f"Model ready on {', '.join(self.model.get_providers())}")
+            return True
+        except Exception as e:
+            print(f"Failed to load {self.onnx_model_path}: {e}")
+            print("Falling back to transformers...")
+            self.model = None
+            self.processor = None
+            return False
+    
+    def _generate_onnx(self, input_features: np.ndarray) -> np.ndarray:
+        """
+        Run the onnxruntime beam search graph with greedy decoding
+        
+        Args:
+            input_features: Log-mel features of shape [batch, 80, 3000]
+            
+        Returns:
+            Predicted token ids of shape [batch, sequence_length]
+        """
+        batch_size = input_features.shape[0]
+        feature_dtype = np.float16 if self._onnx_inputs["input_features"] == "tensor(float16)" else np.float32
+        inputs = {
+            "input_features": input_features.astype(feature_dtype),
+            # max_length counts the forced prompt tokens as well
+            "max_length": np.array([len(self._onnx_prompt_ids) + MAX_NEW_TOKENS], dtype=np.int32),
+            "min_length": np.array([0], dtype=np.int32),
+            "num_beams": np.array([1], dtype=np.int32),
+            "num_return_sequences": np.array([1], dtype=np.int32),
+            "length_penalty": np.array([1.0], dtype=np.float32),
+            "repetition_penalty": np.array([1.0], dtype=np.float32),
+            "decoder_input_ids": np.array([self._onnx_prompt_ids] * batch_size, dtype=np.int32),
+        }
+        # Older exports also expect an attention mask over the features
+        if "attention_mask" in self._onnx_inputs:
+            inputs["attention_mask"] = np.ones(input_features.shape, dtype=np.int32)
+        
+        inputs = {name: value for name, value in inputs.items() if name in self._onnx_inputs}
+        sequences = self.model.run(["sequences"], inputs)[0]
+        return sequences[:, 0, :]
+    
+    def _prepare_audio(self, audio_input: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Downmix audio to mono and resample it to 16kHz
+        
+        Args:
+            audio_input: Decoded audio samples
+            sample_rate: Sample rate of the decoded audio
+            
+        Returns:
+            Mono 16kHz audio samples
+        """
+        # Ensure mono audio
+        if len(audio_input.shape) > 1:
+            audio_input = np.mean(audio_input, axis=1)
+        
+        # Resample to 16kHz if needed, on the GPU when one is available
+        if sample_rate != 16000:
+            if self.device == "cuda":
+                try:
+                    import torchaudio
+                    waveform = torch.from_numpy(np.ascontiguousarray(audio_input, dtype=np.float32)).to(self.device)
+                    return torchaudio.functional.resample(waveform, sample_rate, 16000).cpu().numpy()
+                except ImportError:
+                    pass
+            
+            try:
+                import soxr
+                audio_input = soxr.resample(audio_input, sample_rate, 16000, quality="HQ")
+            except ImportError:
+                print("Warning: soxr not available, audio may not be resampled properly")
+        
+        return audio_input
+    
+    def transcribe_audio(self, audio: Union[str, np.ndarray], sample_rate: int = 16000) -> Optional[str]:
+        """
+        Transcribe an audio file or decoded audio samples to text
+        
+        Args:
+            audio: Path to audio file or decoded audio samples
+            sample_rate: Sample rate of the audio samples (ignored for file paths)
             
         Returns:
             Transcribed text or None if error
         """
-        if self.processor is None or self.model is None:
+        if self.model is None:
             self.load_model()
             
         try:
             # Load and preprocess audio
-            audio_input, sample_rate = sf.read(audio_file_path)
+            if isinstance(audio, str):
+                audio_input, sample_rate = sf.read(audio, dtype="float32")
+            else:
+                audio_input = audio
+            audio_input = self._prepare_audio(audio_input, sample_rate)
             
-            # Ensure mono audio
-            if len(audio_input.shape) > 1:
-                audio_input = np.mean(audio_input, axis=1)
+            # Split recordings longer than the encoder window and decode the chunks as one batch
+            if self.backend == "ct2":
+                # faster-whisper windows long audio itself
+                chunks = [audio_input]
+            elif self.vad_model is not None:
+                # Only send speech to the encoder, silence-only recordings yield no chunks
+                chunks = self._speech_chunks(audio_input)
+            else:
+                chunks = [
+                    audio_input[start:start + CHUNK_SAMPLES]
+                    for start in range(0, len(audio_input), CHUNK_SAMPLES)
+                ]
+            transcription = " ".join(text for text in self.transcribe_batch(chunks) if text)
             
-            # Resample to 16kHz if needed
-            if sample_rate != 16000:
-                try:
-                    import librosa
-                    audio_input = librosa.resample(audio_input, orig_sr=sample_rate, target_sr=16000)
-                except ImportError:
-                    print("Warning: librosa not available, audio may not be resampled properly")
+            return transcription or None
+            
+        except Exception as e:
+            print(f"Error transcribing audio: {e}")
+            return None
+    
+    def transcribe_batch(self, audio_arrays: List[np.ndarray]) -> List[str]:
+        """
+        Transcribe several mono 16kHz audio clips with a single generate call
+        
+        Args:
+            audio_arrays: Audio clips of at most 30 seconds each
             
-            # Process audio to input features
+        Returns:
+            Transcribed text for each clip
+        """
+        if self.model is None:
+            self.load_model()
+        
+        if not audio_arrays:
+            return []
+        
+        # faster-whisper skips silence (Silero VAD) itself
+        if self.backend == "ct2":
+            transcriptions = []
+            for audio_input in audio_arrays:
+                segments, _ = self.model.transcribe(
+                    audio_input,
+                    language="id",
+                    beam_size=1,
+                    vad_filter=True
+                )
+                transcriptions.append("".join(segment.text for segment in segments).strip())
+            return transcriptions
+        
+        if self.backend == "onnx":
             input_features = self.processor(
-                audio_input, 
+                audio_arrays,
+                sampling_rate=16000,
+                return_tensors="np"
+            ).input_features
+            predicted_ids = self._generate_onnx(input_features)
+        else:
+            # Process audio to input features, stacked to [batch, 80, 3000]
+            input_features = self.processor(
+                audio_arrays, 
                 sampling_rate=16000, 
                 return_tensors="pt"
             ).input_features
             
-            # Move to device
-            input_features = input_features.to(self.device)
+            # Move to device in the model's precision
+            input_features = input_features.to(self.device, dtype=self.dtype)
             
             # Generate token ids
-            with torch.no_grad():
-                predicted_ids = self.model.generate(input_features)
-            
-            # Decode token ids to text
-            transcription = self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
-            
-            return transcription[0].strip() if transcription else None
+            with self._inference_lock, torch.inference_mode():
+                predicted_ids = self.model.generate(
+                    input_features,
+                    num_beams=1,
+                    max_new_tokens=MAX_NEW_TOKENS,
+                    use_cache=True,
+                    language="id",
+                    task="transcribe"
+                )
+        
+        # Decode token ids to text
+        transcription = self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+        
+        return [text.strip() for text in transcription]
+    
+    def _read_pcm16_mono_16k(self, audio_bytes: bytes) -> Optional[np.ndarray]:
+        """
+        Read samples from a canonical 44-byte-header WAV that is already 16kHz mono 16-bit PCM
+        
+        Args:
+            audio_bytes: WAV file data as bytes
             
-        except Exception as e:
-            print(f"Error transcribing audio: {e}")
+        Returns:
+            Float32 samples in [-1, 1] or None if the audio needs a full decode
+        """
+        if (
+            len(audio_bytes) < 44
+            or audio_bytes[0:4] != b"RIFF"
+            or audio_bytes[8:12] != b"WAVE"
+            or audio_bytes[12:16] != b"fmt "
+            or audio_bytes[36:40] != b"data"
+        ):
             return None
+        
+        audio_format, channels, sample_rate, _, _, bits_per_sample = struct.unpack_from("<HHIIHH", audio_bytes, 20)
+        if (audio_format, channels, sample_rate, bits_per_sample) != (1, 1, 16000, 16):
+            return None
+        
+        # Recorders that stream the file may leave the data size unset, so clamp to what's there
+        (data_size,) = struct.unpack_from("<I", audio_bytes, 40)
+        data_size = min(data_size, len(audio_bytes) - 44)
+        pcm = np.frombuffer(audio_bytes, dtype=np.int16, count=data_size // 2, offset=44)
+        return pcm.astype(np.float32) / 32768.0
     
     def transcribe_audio_bytes(self, audio_bytes: bytes) -> Optional[str]:
         """
@@ -117,19 +476,15 @@ class WhisperASR:
             Transcribed text or None if error
         """
         try:
-            # Save bytes to temporary file
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file.write(audio_bytes)
-                temp_file_path = temp_file.name
+            # Already 16kHz mono 16-bit PCM: slice the samples out without decoding
+            pcm = self._read_pcm16_mono_16k(audio_bytes)
+            if pcm is not None:
+                return self.transcribe_audio(pcm, 16000)
             
-            # Transcribe the temporary file
-            result = self.transcribe_audio(temp_file_path)
-            
-            # Clean up temporary file
-            os.unlink(temp_file_path)
-            
-            return result
+            # Decode straight from memory instead of round-tripping through a temp file
+            audio_input, sample_rate = sf.read(io.BytesIO(audio_bytes), dtype="float32")
+            return self.transcribe_audio(audio_input, sample_rate)
             
         except Exception as e:
             print(f"Error transcribing audio bytes: {e}")
-            return None
\ No newline at end of file
+            return None